@@ -1,8 +1,11 @@
 import csv
 import glob
+import mmap
 import os
 import gzip
 import multiprocessing as mp
+import queue
+import tempfile
 import time
 import matplotlib.pyplot as plt
 import numpy as np
@@ -12,23 +15,36 @@ import argparse
 import datetime
 from tqdm import tqdm
 from dataclasses import dataclass
+from collections import OrderedDict
+from itertools import chain
 from pathlib import Path
 from io import SEEK_END
 import zlib
 from colorama import Fore
 import pkg_resources
 
+try:
+    import rapidgzip # optional, for parallel decompression of .gz files
+except ImportError:
+    rapidgzip = None
+
+try:
+    from isal import igzip_threaded # optional, ISA-L decompression of .gz files in a background thread
+except ImportError:
+    igzip_threaded = None
+
 #####################
 
 @dataclass
 class Features:
     
-    """ Each feature will have its own class instance, where the read counts will be kept.
-    Each feature class is stored in a dictionary with the name as its key. 
-    See the "guides loader" function """   
+    """ All the features and their read counts, kept as parallel containers.
+    "index" maps each feature sequence (bytes) to its row in "names" and "counts".
+    See the "features_loader" function """   
     
-    name: str
-    counts: int
+    index: dict
+    names: list
+    counts: np.ndarray
 
 def path_finder(folder_path,extension):
     
@@ -43,7 +59,8 @@ def path_finder(folder_path,extension):
 
 def path_parser(folder_path, extension): 
     
-    """ parses the file names and paths into an ordered list for later use"""
+    """ parses the file names and paths into an ordered list of (path, size) 
+    pairs for later use"""
 
     pathing=path_finder(folder_path,extension)
     if extension != '*reads.csv':
@@ -51,22 +68,22 @@ def path_parser(folder_path, extension):
         """sorting by size makes multiprocessing more efficient 
             as the bigger files will be ran first, thus maximizing processor queing """
         
-        ordered = [path[0] for path in sorted(pathing, key=lambda e: e[-1])]#[::-1]
+        ordered = [tuple(path) for path in sorted(pathing, key=lambda e: e[-1])]#[::-1]
 
         if ordered == []:
             print(f"\n{Fore.BLUE} {datetime.datetime.now().strftime('%c')}{Fore.RESET} [{Fore.RED}FATAL{Fore.RESET}] Check the path to the {extension} files folder. No files of this type found.\n")
             raise Exception
 
     else:
-        ordered = [path[0] for path in sorted(pathing, reverse = False)]
+        ordered = [tuple(path) for path in sorted(pathing, reverse = False)]
 
     return ordered
 
 def features_loader(guides):
     
     """ parses the features names and sequences from the indicated features .csv file.
-    Creates a dictionary using the feature sequence as key, with an instace of the 
-    Features class as respective value. If duplicated features sequences exist, 
+    Returns an instance of the Features class, with the features in the order
+    of the output files. If duplicated features sequences exist, 
     this will be caught in here"""
     
     print(f"\n{Fore.BLUE} {datetime.datetime.now().strftime('%c')}{Fore.RESET} [{Fore.GREEN}INFO{Fore.RESET}] Loading Features")
@@ -75,7 +92,7 @@ def features_loader(guides):
         print(f"\n{Fore.BLUE} {datetime.datetime.now().strftime('%c')}{Fore.RESET} [{Fore.RED}FATAL{Fore.RESET}] Check the path to the features file.\nNo .csv file found in the following path: {guides}\n")
         raise Exception
     
-    features = {}
+    sequences = {}
     names = set()
     
     try:
@@ -85,27 +102,161 @@ def features_loader(guides):
                     line = line[:-1]
                 line = line.split(",")
                 sequence = line[1].upper()
-                sequence = sequence.replace(" ", "")
+                sequence = sequence.replace(" ", "").encode("ascii")
                 name = line[0]
                 
                 if name in names:   
                     print(f"{Fore.BLUE} {datetime.datetime.now().strftime('%c')}{Fore.RESET} [{Fore.YELLOW}WARNING{Fore.RESET}] The name {name} seems to appear at least twice. This MIGHT result in unexpected behaviour. Please have only unique name entries in your features.csv file.")
 
-                if sequence not in features:
-                    features[sequence] = Features(name, 0)
+                if sequence not in sequences:
+                    sequences[sequence] = name
                     names.add(name)
                     
                 else:
-                    print(f"{Fore.BLUE} {datetime.datetime.now().strftime('%c')}{Fore.RESET} [{Fore.YELLOW}WARNING{Fore.RESET}] {features[sequence].name} and {name} share the same sequence. Only {features[sequence].name} will be considered valid. {name} will be ignored.")
+                    print(f"{Fore.BLUE} {datetime.datetime.now().strftime('%c')}{Fore.RESET} [{Fore.YELLOW}WARNING{Fore.RESET}] {sequences[sequence]} and {name} share the same sequence. Only {sequences[sequence]} will be considered valid. {name} will be ignored.")
 
     except IndexError:
         print(f"\n{Fore.BLUE} {datetime.datetime.now().strftime('%c')}{Fore.RESET} [{Fore.RED}FATAL{Fore.RESET}] The given .csv file doesn't seem to be comma separated. Please double check that the file's column separation is ','\n")
         raise Exception
     
-    print(f"{Fore.BLUE} {datetime.datetime.now().strftime('%c')}{Fore.RESET} [{Fore.GREEN}INFO{Fore.RESET}] {len(features)} different features were provided.")
+    # the features are kept in the order of the output files
+    try:
+        ordered = sorted(sequences.items(), key = lambda item: int(item[1])) #numerical sorting
+    except ValueError:
+        ordered = sorted(sequences.items(), key = lambda item: item[1]) #alphabetical sorting
+    
+    features = Features({sequence:n for n,(sequence,_) in enumerate(ordered)},
+                        [name for _,name in ordered],
+                        np.zeros(len(ordered), dtype=np.int64))
+    
+    print(f"{Fore.BLUE} {datetime.datetime.now().strftime('%c')}{Fore.RESET} [{Fore.GREEN}INFO{Fore.RESET}] {len(features.names)} different features were provided.")
     return features
 
-def reads_counter(i,o,raw,features,param,cpu,failed_reads,passed_reads,preprocess=False):
+def fastq_chunker(current,size=None,chunksize=16777216,batch=65536):
+    
+    """ Reads the fastq file in large binary chunks instead of line by line.
+    The newlines of each chunk are located with numpy, and only whole reads
+    (4 lines) are handed over, in batches of up to "batch" reads. Whatever is 
+    left of an incomplete read at the end of a chunk is carried over to the next one.
+    Yields the chunk together with the line boundaries, where line n spans 
+    chunk[bounds[n]+1:bounds[n+1]]. When a size is given, only that many bytes
+    are read from the current position of the file. Memory mapped files 
+    are chunked in place (see "mapped_chunker")"""
+    
+    if isinstance(current, mmap.mmap):
+        yield from mapped_chunker(current,size,chunksize,batch)
+        return
+    
+    tail = b""
+    while True:
+        if size is None:
+            data = current.read(chunksize)
+        else:
+            data = current.read(min(chunksize,size))
+            size -= len(data)
+        if not data:
+            if (tail == b"") or (tail.endswith(b"\n")):
+                return
+            data = b"\n" #the last line of the file might not end with a newline
+            
+        chunk = tail + data
+        newlines = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == 0x0A)
+        complete = len(newlines) - len(newlines) % 4
+        if complete == 0:
+            tail = chunk
+            continue
+        
+        bounds = np.concatenate(([-1],newlines[:complete]))
+        for i in range(0,complete,batch*4):
+            yield chunk,bounds[i:i+batch*4+1]
+        tail = chunk[bounds[-1]+1:]
+
+def mapped_chunker(mapped,size=None,chunksize=16777216,batch=65536):
+    
+    """ Same as "fastq_chunker", for a memory mapped fastq file. The chunks are 
+    read only views of the mapped file, so nothing is copied, and every chunk 
+    starts right after the last whole read of the previous one. A read longer 
+    than the chunk size doubles the size of the chunk"""
+    
+    start = mapped.tell()
+    end = len(mapped) if size is None else start+size
+    window = chunksize
+    while start < end:
+        stop = min(start+window,end)
+        chunk = memoryview(mapped)[start:stop]
+        if (stop == len(mapped)) & (mapped[stop-1] != 0x0A):
+            chunk = bytes(chunk) + b"\n" #the last line of the file might not end with a newline
+        
+        newlines = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == 0x0A)
+        complete = len(newlines) - len(newlines) % 4
+        if complete == 0:
+            if stop == end:
+                return
+            window *= 2
+            continue
+        
+        bounds = np.concatenate(([-1],newlines[:complete]))
+        for i in range(0,complete,batch*4):
+            yield chunk,bounds[i:i+batch*4+1]
+        start += int(bounds[-1])+1
+        window = chunksize
+
+def read_finder(current,place):
+    
+    """ Finds the byte place of the first read starting at, or after, the given
+    place of an uncompressed fastq file. A read starts with a line beginning with 
+    @ that has a line beginning with + two lines below. Quality lines can also 
+    begin with @, but two lines below a quality line there is always a sequence"""
+    
+    if place == 0:
+        return 0
+    
+    window = 65536
+    while True:
+        current.seek(place-1)
+        data = current.read(window)
+        lines = data.split(b"\n")
+        offset = place + len(lines[0])
+        for n in range(1,len(lines)-2):
+            if lines[n].startswith(b"@") & lines[n+2].startswith(b"+"):
+                return offset
+            offset += len(lines[n])+1
+        if len(data) < window:
+            return None
+        window *= 4
+
+def fastq_splitter(raw,size,parts):
+    
+    """ Splits an uncompressed fastq file (of the given size in bytes) into up to 
+    the given number of parts of similar size, returned as (start,end) byte places. 
+    Every part begins at the start of a read (see "read_finder"). Compressed files 
+    cannot be split, and are returned whole (as None)"""
+    
+    _, ext = os.path.splitext(raw)
+    if (ext == ".gz") or (parts < 2):
+        return [None]
+    
+    places = [0]
+    with open(raw, "rb") as current:
+        for n in range(1,parts):
+            place = read_finder(current,max(size*n//parts,places[-1]))
+            if place is None:
+                break
+            if place > places[-1]:
+                places.append(place)
+    places.append(size)
+    
+    return [(start,end) for start,end in zip(places[:-1],places[1:])]
+
+def phred_table(quality_set):
+    
+    """ Creates a 256 byte translation table where every forbidden Phred score
+    character is mapped to 1 and every other byte to 0. Translating a quality 
+    string with it allows the quality check to be done with a single bytes search"""
+    
+    return bytes(int(chr(n) in quality_set) for n in range(256))
+
+def reads_counter(i,o,raw,features,param,cpu,failed_reads,passed_reads,preprocess=False,place=None,known_reads=None):
     
     """ Reads the fastq file on the fly to avoid RAM issues. 
     Each read is assumed to be composed of 4 lines, with the sequence being 
@@ -114,191 +265,275 @@ def reads_counter(i,o,raw,features,param,cpu,failed_reads,passed_reads,preproces
     The quality of the obtained trimmed read is crossed against the indicated
     Phred score for quality control.
     If the read has a perfect match with a feature, the respective feature gets a 
-    read increase of 1 (done by calling .counts from the respective feature class 
-    from the feature class dictionary).
+    read increase of 1 (in the counts row given by the features index).
     If the read doesnt have a perfect match, it is sent for mismatch comparison
     via the "mismatch_search_handler" function.
     """
-
-    def binary_converter(features):
-
-        """ Parses the input features into numba dictionaries with int8 layout. 
-        Converts all DNA sequences to their respective binary array forms. 
-        This gives some computing speed advantages with mismatches."""
-        
-        from numba import types
-        from numba.typed import Dict
-        
-        container = Dict.empty(key_type=types.unicode_type,
-                               value_type=types.int8[:])
-
-        for sequence in features:
-            container[sequence] = seq2bin(sequence)
-        return container
     
-    def unfixed_starting_place_parser(read,qual,param,i):
+    if known_reads is None:
+        _,_,known_reads = hash_tables_loader(None)
+
+    def unfixed_starting_place_parser(read,qual_start,qual_end,translated_up,translated_down,param,i):
         
         """ Determines the starting place of a read trimming based on the
         inputed parameters for upstream/downstream sequence matching. 
         Also takes into consideration the quality of that search sequence,
-        and mismatches it might have"""
+        and mismatches it might have. The read quality spans qual_start:qual_end
+        of the chunks translated with the up/downstream Phred tables"""
 
-        read_bin=seq2bin(read)
         start,end = None,None
 
         if (param['upstream'] is not None) & (param['downstream'] is not None):
-            start=border_finder(param['upstream_bin'][i],
-                                read_bin,param['miss_search_up'])
+            start=border_search(param['upstream_seq'][i],
+                                read,param['miss_search_up'])
             
-            if start is not None:
-                end=border_finder(param['downstream_bin'][i],
-                                  read_bin,param['miss_search_down'],
+            if start != -1:
+                end=border_search(param['downstream_seq'][i],
+                                  read,param['miss_search_down'],
                                   start_place=start+1)
     
-                if end is not None:
-                    qual_up = str(qual[start:start+len(param['upstream_bin'][i])],"utf-8")
-                    qual_down = str(qual[end:end+len(param['downstream_bin'][i])],"utf-8")
-                    
-                    if (len(param['quality_set_up'].intersection(qual_up)) == 0) &\
-                        (len(param['quality_set_down'].intersection(qual_down)) == 0):
-                        start+=len(param['upstream_bin'][i])
-                        return start,end
+                if end != -1:
+                    if param['quality_check_up']:
+                        place = qual_start+start
+                        if translated_up.find(b"\x01",place,min(place+len(param['upstream_seq'][i]),qual_end)) != -1:
+                            return None,None
+                    if param['quality_check_down']:
+                        place = qual_start+end
+                        if translated_down.find(b"\x01",place,min(place+len(param['downstream_seq'][i]),qual_end)) != -1:
+                            return None,None
+                    start+=len(param['upstream_seq'][i])
+                    return start,end
 
         elif (param['upstream'] is not None) & (param['downstream'] is None):
-            start=border_finder(param['upstream_bin'][i],
-                                read_bin,param['miss_search_up'])
+            start=border_search(param['upstream_seq'][i],
+                                read,param['miss_search_up'])
             
-            if start is not None:
-                qual_up = str(qual[start:start+len(param['upstream_bin'][i])],"utf-8")
-                
-                if len(param['quality_set_up'].intersection(qual_up)) == 0:
-                    start+=len(param['upstream_bin'][i])
-                    end = start + param['length']
-                    return start,end
+            if start != -1:
+                if param['quality_check_up']:
+                    place = qual_start+start
+                    if translated_up.find(b"\x01",place,min(place+len(param['upstream_seq'][i]),qual_end)) != -1:
+                        return None,None
+                start+=len(param['upstream_seq'][i])
+                end = start + param['length']
+                return start,end
             
         elif (param['upstream'] is None) & (param['downstream'] is not None):
-            end=border_finder(param['downstream_bin'][i],
-                              read_bin,param['miss_search_down'])
+            end=border_search(param['downstream_seq'][i],
+                              read,param['miss_search_down'])
             
-            if end is not None:
-                qual_down = str(qual[end:end+len(param['downstream_bin'][i])],"utf-8")
-                
-                if len(param['quality_set_down'].intersection(qual_down)) == 0:
-                    start = end-param['length']
-                    return start,end
+            if end != -1:
+                if param['quality_check_down']:
+                    place = qual_start+end
+                    if translated_down.find(b"\x01",place,min(place+len(param['downstream_seq'][i]),qual_end)) != -1:
+                        return None,None
+                start = end-param['length']
+                return start,end
 
         return None,None
 
-    def progress_bar(i,o,raw,cpu):
+    def progress_bar(i,o,raw,cpu,place):
         
         def getuncompressedsize(raw):
             
+            """ The gzip trailer holds the uncompressed size (modulo 4GB), so 
+            the file doesn't need to be decompressed just to size the bar"""
+            
             if ext == ".gz":
-                return sum(1 for _ in gzip.open(raw, 'rt'))
+                with open(raw, "rb") as current:
+                    current.seek(-4, SEEK_END)
+                    size = int.from_bytes(current.read(4), "little")
+                if size < param["file_sizes"][raw]: # the size wrapped around 4GB
+                    return None
+                return size
             else:
-                return sum(1 for _ in open(raw, 'rt'))
+                return param["file_sizes"][raw]
 
-        if o > cpu:
+        if (o > cpu) or (place is not None):
             current = mp.current_process()
             pos = current._identity[0]#-1
         else:
             pos = i+1
-        total_file_size = getuncompressedsize(raw)
+        if place is None:
+            total_file_size = getuncompressedsize(raw)
+        else:
+            total_file_size = place[1]-place[0]
         tqdm_text = f"Processing file {i+1} out of {o}"
-        return tqdm(total=total_file_size,desc=tqdm_text, position=pos,colour="green",leave=False,ascii=True,unit="lines")
+        return tqdm(total=total_file_size,desc=tqdm_text, position=pos,colour="green",leave=False,ascii=True,
+                    unit="B",unit_scale=True,unit_divisor=1024,mininterval=0.5)
     
-    def fastq_parser(current,features,failed_reads,passed_reads,fixed_start):
+    def fastq_parser(current,features,failed_reads,passed_reads,fixed_start,size):
         
-        reading = []
         mismatch = [n+1 for n in range(param['miss'])]
         perfect_counter, imperfect_counter, non_aligned_counter, reads,quality_failed = 0,0,0,0,0
-        ram_clearance=ram_lock()
-
-        if param['miss'] != 0:
-            binary_features = binary_converter(features)
+        quality_table = param['quality_table']
+        
+        # fixed position features in Counter mode are trimmed, quality checked and counted in numba
+        compiled = (fixed_start) & (param['Running Mode']=='C')
 
-        for line in current:
-            quality_failed_flag = np.zeros(param['search_iterations'])
+        if (param['miss'] != 0) & (param['Running Mode']=='C'):
+            binary_features = param['binary_features']
+            
+        # a list is the fastest to increment one read at a time, and is added to the features counts at the end
+        counts = [0]*len(features.names)
+        index = features.index
+        
+        if compiled:
+            feat_bytes,feat_offsets,table = arrays_loader(param['features_table'])
+            neighbours_table = arrays_loader(param['neighbours_table'])
+            feat_counts = np.zeros(len(features.names), dtype=np.int64)
+            starts = np.array(param['start_positioning'], dtype=np.int64)
+            ends = np.array(param['end_positioning'], dtype=np.int64)
+            quality_mask = np.frombuffer(quality_table, dtype=np.uint8)
+
+        # the initialization only needs the first 10000 reads, so no more than that is decompressed
+        chunksize = 1048576 if preprocess else 16777216
+        for chunk,bounds in fastq_chunker(current,size,chunksize):
             if (not preprocess) & (param['Progress bar']):
-                pbar.update(1)
-            reading.append(line[:-1])
+                pbar.update(int(bounds[-1]-bounds[0])) #once per batch of reads, in bytes
             
-            if len(reading) == 4: #a read always has 4 lines
-                
-                full_feature = ""
-                for i in range(param['search_iterations']):
+            batch = (len(bounds)-1)//4
+            if preprocess:
+                batch = min(batch,10000-reads)
             
-                    if not fixed_start:
-
-                        start,end=unfixed_starting_place_parser(str(reading[1],"utf-8"),\
-                                                                reading[3],\
-                                                                param,i)
-                            
-                        if (start is not None) & (end is not None):
-                            if end < start: #if the end is not found or found before the start
-                                start=None
-                                quality_failed_flag[i] = 1 #this includes reads without search sequences as failed at quality
-                        else:
-                            quality_failed_flag[i] = 1
-    
-                    if fixed_start:
-                        start = param['start_positioning'][i]
-                        end = param['end_positioning'][i]
-    
-                    if (fixed_start) or (start is not None):
-                        seq = str(reading[1][start:end].upper(),"utf-8")
-                        quality = str(reading[3][start:end],"utf-8") #convert from bin to str
-    
-                        if len(param['quality_set'].intersection(quality)) == 0:
-                            full_feature += f":{seq}"
-                        else:
-                            quality_failed_flag[i] = 1          
+            if compiled:
+                keys = np.empty(starts.size*(bounds[batch*4]-bounds[0]+batch), dtype=np.uint8)
+                key_bounds = np.zeros(batch+1, dtype=np.int64)
+                fingerprints = np.empty(batch, dtype=np.uint64)
+                perfect,imperfect,failed_quality,non_aligned,unmatched = fixed_reads_counter(np.frombuffer(chunk, dtype=np.uint8),
+                                                                       bounds,batch,starts,ends,quality_mask,param['quality_check'],
+                                                                       table,feat_bytes,feat_offsets,feat_counts,
+                                                                       keys,key_bounds,fingerprints,
+                                                                       *neighbours_table,mismatch == [1])
+                perfect_counter += perfect
+                imperfect_counter += imperfect
+                quality_failed += failed_quality
+                non_aligned_counter += non_aligned
                 
-                if full_feature != "":
-                    seq = full_feature[1:] #remove the first :
-                    if param['Running Mode']=='C':
-                        if seq in features:
-                            features[seq].counts += 1
-                            perfect_counter += 1
-
-                        elif mismatch != []:
-                            features,imperfect_counter,failed_reads,passed_reads,non_aligned_counter=\
-                            mismatch_search_handler(seq,
-                                                    mismatch,
-                                                    failed_reads,
-                                                    binary_features,
-                                                    imperfect_counter,
-                                                    features,
-                                                    passed_reads,
-                                                    ram_clearance,
-                                                    non_aligned_counter
-                                                    )
-
-                        else:
-                            non_aligned_counter += 1
-
-                    else:
-                        if seq not in features:
-                            features[seq] = Features(seq, 1)
-                        else:
-                            features[seq].counts += 1
-                        perfect_counter += 1
-                    
-                if quality_failed_flag.all():
-                    quality_failed += 1
+                if mismatch == []:
+                    non_aligned_counter += unmatched
+                else:
+                    keys = keys[:key_bounds[unmatched]].tobytes()
+                    key_bounds = key_bounds.tolist()
+                    fingerprints = fingerprints[:unmatched].tolist()
+                    for n in range(unmatched):
+                        counts,imperfect_counter,failed_reads,passed_reads,non_aligned_counter=\
+                        mismatch_search_handler(keys[key_bounds[n]:key_bounds[n+1]],
+                                                fingerprints[n],
+                                                mismatch,
+                                                failed_reads,
+                                                binary_features,
+                                                imperfect_counter,
+                                                counts,
+                                                passed_reads,
+                                                known_reads,
+                                                param,
+                                                non_aligned_counter
+                                                )
+                
+                reads += batch
                 
-                reading = []
-                reads += 1
+            else:
+                # the line boundaries are indexes into the chunk, so the reads are never copied line by line
+                chunk = bytes(chunk) # the chunks of memory mapped files are views (see "mapped_chunker")
+                view = memoryview(chunk)
+                if param['quality_check']:
+                    translated = chunk.translate(quality_table)
+                # the search sequences quality is checked in place, in the whole translated chunk
+                if not fixed_start:
+                    translated_up,translated_down = None,None
+                    if (param['upstream'] is not None) & (param['quality_check_up']):
+                        translated_up = chunk.translate(param['quality_table_up'])
+                    if (param['downstream'] is not None) & (param['quality_check_down']):
+                        translated_down = chunk.translate(param['quality_table_down'])
+                bounds = bounds.tolist()
                 
-                # keeps RAM under control by avoiding overflow
-                if reads % 1000000 == 0:
-                    ram_clearance=ram_lock()
+                for line in range(0,batch*4,4): #a read always has 4 lines
+                    quality_failed_flag = [0]*param['search_iterations']
+                    seq_start,seq_end = bounds[line+1]+1,bounds[line+2]
+                    qual_start,qual_end = bounds[line+3]+1,bounds[line+4]
+                    
+                    full_feature = b""
+                    for i in range(param['search_iterations']):
                 
-                if preprocess:
-                    if reads == 10000:
-                        return reads,perfect_counter,imperfect_counter,features,failed_reads,passed_reads,0,0
+                        if not fixed_start:
+    
+                            start,end=unfixed_starting_place_parser(bytes(view[seq_start:seq_end]),\
+                                                                    qual_start,qual_end,\
+                                                                    translated_up,translated_down,\
+                                                                    param,i)
+                                
+                            if (start is not None) & (end is not None):
+                                if end < start: #if the end is not found or found before the start
+                                    start=None
+                                    quality_failed_flag[i] = 1 #this includes reads without search sequences as failed at quality
+                            else:
+                                quality_failed_flag[i] = 1
         
-        if (not preprocess) & (param['Progress bar']):
+                        if fixed_start:
+                            start = param['start_positioning'][i]
+                            end = param['end_positioning'][i]
+        
+                        if (fixed_start) or (start is not None):
+                            # same trimming as slicing the read itself, but as absolute positions in the chunk
+                            first,last,_ = slice(start,end).indices(seq_end-seq_start)
+        
+                            if (not param['quality_check']) or (translated.find(b"\x01",qual_start+first,qual_start+last) == -1):
+                                full_feature += b":" + bytes(view[seq_start+first:seq_start+last]).upper()
+                            else:
+                                quality_failed_flag[i] = 1          
+                    
+                    if full_feature != b"":
+                        seq = full_feature[1:] #remove the first :
+                        if param['Running Mode']=='C':
+                            if seq in index:
+                                counts[index[seq]] += 1
+                                perfect_counter += 1
+    
+                            elif mismatch != []:
+                                counts,imperfect_counter,failed_reads,passed_reads,non_aligned_counter=\
+                                mismatch_search_handler(seq,
+                                                        read_fingerprint(seq),
+                                                        mismatch,
+                                                        failed_reads,
+                                                        binary_features,
+                                                        imperfect_counter,
+                                                        counts,
+                                                        passed_reads,
+                                                        known_reads,
+                                                        param,
+                                                        non_aligned_counter
+                                                        )
+    
+                            else:
+                                non_aligned_counter += 1
+    
+                        else:
+                            if seq not in index:
+                                index[seq] = len(counts)
+                                features.names.append(seq.decode("utf-8"))
+                                counts.append(1)
+                            else:
+                                counts[index[seq]] += 1
+                            perfect_counter += 1
+                        
+                    if all(quality_failed_flag):
+                        quality_failed += 1
+                    
+                    reads += 1
+            
+            if (preprocess) & (reads == 10000):
+                break
+        
+        counts = np.array(counts, dtype=np.int64)
+        counts[:features.counts.size] += features.counts #the Extractor mode might have found new features
+        if compiled:
+            counts += feat_counts
+        features.counts = counts
+        
+        if preprocess:
+            return reads,perfect_counter,imperfect_counter,features,failed_reads,passed_reads,0,0
+        
+        if param['Progress bar']:
             pbar.close()
 
         return reads,perfect_counter,imperfect_counter,features,failed_reads,passed_reads,non_aligned_counter,quality_failed
@@ -314,15 +549,15 @@ def reads_counter(i,o,raw,features,param,cpu,failed_reads,passed_reads,preproces
         len_up,len_down = 0,0
         fixed_start = False
         if param['upstream'] is not None:
-            param['upstream_bin'] = [seq2bin(n.upper()) for n in param['upstream'].split(",")]
-            len_up = len(param['upstream_bin'])
+            param['upstream_seq'] = [n.upper().encode("ascii") for n in param['upstream'].split(",")]
+            len_up = len(param['upstream_seq'])
         if param['downstream'] is not None:
-            param['downstream_bin'] = [seq2bin(n.upper()) for n in param['downstream'].split(",")]
-            len_down = len(param['downstream_bin'])
+            param['downstream_seq'] = [n.upper().encode("ascii") for n in param['downstream'].split(",")]
+            len_down = len(param['downstream_seq'])
             
         if (param['downstream'] is not None) & (param['upstream'] is not None):
-            if len(param['downstream_bin']) != len(param['upstream_bin']):
-                print(f"\n{Fore.BLUE} {datetime.datetime.now().strftime('%c')}{Fore.RESET} [{Fore.RED}FATAL{Fore.RESET}] Up and Downstream sequences must be submitted in concurrent pairs, separated by ,.\n You submitted {len(param['downstream_bin'])} downstream sequences and {len(param['upstream_bin'])} upstream sequences.")
+            if len(param['downstream_seq']) != len(param['upstream_seq']):
+                print(f"\n{Fore.BLUE} {datetime.datetime.now().strftime('%c')}{Fore.RESET} [{Fore.RED}FATAL{Fore.RESET}] Up and Downstream sequences must be submitted in concurrent pairs, separated by ,.\n You submitted {len(param['downstream_seq'])} downstream sequences and {len(param['upstream_seq'])} upstream sequences.")
                 exit()
                 
         param['search_iterations'] = max(len_up,len_down)
@@ -330,109 +565,576 @@ def reads_counter(i,o,raw,features,param,cpu,failed_reads,passed_reads,preproces
     _, ext = os.path.splitext(raw)
     
     if (not preprocess) & (param['Progress bar']):
-        pbar = progress_bar(i,o,raw,cpu)
+        pbar = progress_bar(i,o,raw,cpu,place)
+    
+    # files are already processed in parallel, so the decompression threads are split among them
+    threads = max(1, cpu // max(1, min(o, cpu)))
+    with fastq_opener(raw,threads) as current:
+        if (ext != ".gz") & (param["file_sizes"][raw] > 0):
+            # the uncompressed files are memory mapped, so their chunks are never copied (see "mapped_chunker")
+            current = mmap.mmap(current.fileno(), 0, access=mmap.ACCESS_READ)
+        size = None
+        if place is not None:
+            current.seek(place[0])
+            size = place[1]-place[0]
+        return fastq_parser(current,features,failed_reads,passed_reads,fixed_start,size)
+
+def fastq_opener(raw,threads=1):
+    
+    """ Opens the fastq file for binary reading. .gz files are decompressed in 
+    parallel with rapidgzip (using the indicated number of threads) when it is 
+    installed, then with ISA-L (python-isal) in a background thread, 
+    falling back to the single threaded gzip module otherwise"""
     
+    _, ext = os.path.splitext(raw)
     if ext == ".gz":
-        with gzip.open(raw, "rb") as current:
-            return fastq_parser(current,features,failed_reads,passed_reads,fixed_start)
-    else:
-        with open(raw, "rb")  as current:
-            return fastq_parser(current,features,failed_reads,passed_reads,fixed_start)
+        if rapidgzip is not None:
+            return rapidgzip.open(raw, parallelization=threads)
+        if igzip_threaded is not None:
+            return igzip_threaded.open(raw, "rb", threads=1)
+        return gzip.open(raw, "rb")
+    return open(raw, "rb")
 
 def seq2bin(sequence):
     
-    """ Converts a string to binary, and then to 
-    a numpy array in int8 format"""
+    """ Converts a string (or bytes) to a numpy array in int8 format.
+    The array is a read-only view on the bytes, so nothing gets copied"""
     
-    sequence = bytearray(sequence,'utf8')
-    return np.array((sequence), dtype=np.int8)
+    if not isinstance(sequence, (bytes, bytearray)):
+        sequence = sequence.encode("ascii")
+    return np.frombuffer(sequence, dtype=np.int8)
 
-@njit
-def binary_subtract(array1,array2,mismatch):
+def border_search(seq,read,mismatch,start_place=0):
     
-    """ Used for matching 2 sequences based on the allowed mismatches.
-    Requires the sequences to be in numerical form"""
+    """ Finds the first place in the read (bytes) where the search sequence (bytes)
+    is found with up to the allowed mismatches. Exact searches go through 
+    bytes.find, which runs at C speed. The remaining searches are sent to 
+    "border_finder". The searched places are the same in both cases, 
+    including the windows running over the end of the read. Returns -1 
+    when the search sequence is not found"""
     
-    miss=0
-    for arr1,arr2 in zip(array1,array2):
-        if arr1-arr2 != 0:
-            miss += 1
-        if miss>mismatch:
-            return 0
-    return 1
-
-@njit
-def border_finder(seq,read,mismatch,start_place=0): 
+    s,r = len(seq),len(read)
+    stop_place = min(r-1, start_place+r-s-1)
+    
+    if mismatch == 0:
+        place = read.find(seq,start_place,min(stop_place+s,r))
+        if place != -1:
+            return place
+        
+        # only the windows running over the end of the read are left to check
+        start_place = max(start_place,r-s+1)
+        if start_place > stop_place:
+            return -1
+        
+    return border_finder(seq2bin(seq),seq2bin(read),mismatch,start_place,stop_place,dna_bits(seq))
+
+def dna_bits(seq):
+    
+    """ Returns the number of bits used per basepair when packing the sequence (bytes).
+    Sequences made only of A/C/G/T are packed with 2 bits per basepair, 
+    anything else (N, lowercase, the : between multiple features, etc) 
+    falls back to the raw 8 bit characters"""
+    
+    return 2 if seq.translate(None,b"ACGT") == b"" else 8
+
+@njit(cache=True)
+def word_packer(seq,bits):
+    
+    """ Packs an int8 array into uint64 words, using "bits" bits per basepair:
+    either the raw characters (8), or A/C/G/T as 0/1/2/3 (2). Word n holds the 
+    basepairs from n onwards (8 or 32 of them), padded with 0 past the end of the array.
+    With 2 bits, any other character is flagged in the second (ambiguous) array, 
+    as such a basepair can never match an A/C/G/T"""
+    
+    words = np.zeros(seq.size, dtype=np.uint64)
+    ambiguous = np.zeros(seq.size, dtype=np.uint64)
+    word,flags,shift = np.uint64(0),np.uint64(0),np.uint64(bits)
+    for n in range(seq.size-1,-1,-1):
+        base,unknown = np.int64(seq[n]) & 0xFF,0
+        if bits == 2:
+            if base == 65: #A
+                base = 0
+            elif base == 67: #C
+                base = 1
+            elif base == 71: #G
+                base = 2
+            elif base == 84: #T
+                base = 3
+            else:
+                base,unknown = 0,1
+        word = (word << shift) | np.uint64(base)
+        flags = (flags << shift) | np.uint64(unknown)
+        words[n] = word
+        ambiguous[n] = flags
+    return words,ambiguous
+
+@njit(cache=True)
+def popcount(word):
+    
+    """ Counts the set bits in a uint64 word (SWAR)"""
+    
+    word = word - ((word >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    word = (word & np.uint64(0x3333333333333333)) + ((word >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    word = (word + (word >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return np.int64((word * np.uint64(0x0101010101010101)) >> np.uint64(56))
+
+@njit(cache=True)
+def word_mismatches(word,ambiguous,used,bits):
+    
+    """ Counts the mismatching basepairs in a XORed uint64 word: each basepair
+    with any of its bits set is one mismatch, as is any ambiguous basepair.
+    Only the first "used" basepairs of the word are counted"""
+    
+    if bits == 8:
+        word |= word >> np.uint64(4)
+        word |= word >> np.uint64(2)
+    word |= word >> np.uint64(1)
+    word &= np.uint64(0x0101010101010101) if bits == 8 else np.uint64(0x5555555555555555)
+    word |= ambiguous
+    if used*bits < 64:
+        word &= (np.uint64(1) << np.uint64(used*bits)) - np.uint64(1)
+    return popcount(word)
+
+@njit(cache=True)
+def border_finder(seq,read,mismatch,start_place,stop_place,bits): 
     
     """ Matches 2 sequences (after converting to int8 format)
     based on the allowed mismatches. Used for sequencing searching
-    a start/end place in a read"""
+    a start/end place in a read. Both are packed into uint64 words 
+    (see "word_packer"), so 32 (or 8) basepairs are compared at a time. 
+    Windows running over the end of the read are compared over 
+    the part that overlaps the read. Returns -1 if there is no match"""
 
     s=seq.size
     r=read.size
-    fall_over_index = r-s-1
-    for i,bp in enumerate(read[start_place:]): 
-        comparison = read[start_place+i:s+start_place+i]
-        finder = binary_subtract(seq,comparison,mismatch)
-        if i > fall_over_index:
-            return
-        if finder != 0:
-            return i+start_place
-
-@njit
-def features_all_vs_all(binary_features,read,mismatch):
-    
-    """ Runs the loop of the read vs all sgRNA comparison.
-    Sends individually the sgRNAs for comparison.
-    Returns the final mismatch score"""
-    
-    found = 0
-    r=read.size
-    for guide in binary_features:
-        g=binary_features[guide].size
-        if g==r:
-            if binary_subtract(binary_features[guide],read,mismatch):
-                found+=1
-                found_guide = guide
-                if found>=2:
-                    return
-    if found==1:
-        return found_guide
-
-def mismatch_search_handler(seq,mismatch,failed_reads,binary_features,imperfect_counter,features,passed_reads,ram_clearance,non_aligned_counter):
-    
-    """Converts a read into numpy int 8 form. Runs the imperfect alignment 
-    search for all number of inputed mismatches."""
-    
-    if seq in failed_reads:
-        non_aligned_counter += 1
-        return features,imperfect_counter,failed_reads,passed_reads,non_aligned_counter
+    lanes = 64//bits
+    seq_words,_ = word_packer(seq,bits)
+    read_words,read_ambiguous = word_packer(read,bits)
+    
+    for place in range(start_place,stop_place+1):
+        size = min(s,r-place)
+        miss = 0
+        for n in range(0,size,lanes):
+            miss += word_mismatches(read_words[place+n] ^ seq_words[n],
+                                    read_ambiguous[place+n],
+                                    min(lanes,size-n),bits)
+            if miss > mismatch:
+                break
+        if miss <= mismatch:
+            return place
+    return -1
+
+@njit(cache=True)
+def features_all_vs_all(feat_words,read,mismatch,bits):
+    
+    """ Runs the read (int8 array) vs all features comparison in one pass over the packed 
+    feature matrix (one feature per row, see "binary_converter"). The read 
+    is packed the same way as the features in the same call.
+    Same as searching with 1 up to "mismatch" mismatches in turn: the first number 
+    of mismatches where any feature is found must be unique to one feature, 
+    otherwise the read is ambiguous. 
+    Returns the index of the found feature, or -1 if none was found"""
+    
+    lanes = 64//bits
+    size = read.size
+    read_words,read_ambiguous = word_packer(read,bits)
+    read_words,read_ambiguous = read_words[::lanes],read_ambiguous[::lanes]
+    hits = np.zeros(mismatch+1, dtype=np.int64)
+    found = np.full(mismatch+1, -1, dtype=np.int64)
+    single = feat_words.shape[1] == 1 # features up to 32 basepairs: one XOR and popcount per feature
+    for guide in range(feat_words.shape[0]):
+        if single:
+            miss = word_mismatches(feat_words[guide,0] ^ read_words[0],read_ambiguous[0],size,bits)
+        else:
+            miss = 0
+            for n in range(feat_words.shape[1]):
+                miss += word_mismatches(feat_words[guide,n] ^ read_words[n],
+                                        read_ambiguous[n],
+                                        min(lanes,size-n*lanes),bits)
+                if miss > mismatch:
+                    break
+        
+        if miss <= mismatch:
+            miss = max(miss,1)
+            hits[miss] += 1
+            if found[miss] == -1:
+                found[miss] = guide
+            if hits[1] >= 2: #ambiguous already at the lowest mismatch
+                return -1
+
+    total = 0
+    for miss in range(1,mismatch+1):
+        total += hits[miss]
+        if total == 1:
+            return found[miss]
+        if total >= 2:
+            return -1
+    return -1
+
+@njit(cache=True)
+def slice_indices(start,end,size):
+    
+    """ Same as slice(start,end).indices(size), so that the reads are 
+    trimmed in numba exactly as when slicing them in python"""
+    
+    start = max(start+size,0) if start < 0 else min(start,size)
+    end = max(end+size,0) if end < 0 else min(end,size)
+    return start,end
+
+@njit(cache=True)
+def key_hash(data,start,end):
+    
+    """ FNV-1a hash of data[start:end] (uint8 array)"""
+    
+    code = np.uint64(14695981039346656037)
+    for n in range(start,end):
+        code = (code ^ np.uint64(data[n])) * np.uint64(1099511628211)
+    return code
+
+@njit(cache=True)
+def hash_table_builder(feat_bytes,feat_offsets):
+    
+    """ Builds an open addressing hash table (linear probing) with the index of 
+    every feature, feature n being feat_bytes[feat_offsets[n]:feat_offsets[n+1]].
+    The table is kept at most half full, with empty slots as -1"""
+    
+    size = 2
+    while size < 2*(feat_offsets.size-1):
+        size *= 2
+    
+    table = np.full(size, -1, dtype=np.int64)
+    for feature in range(feat_offsets.size-1):
+        slot = np.int64(key_hash(feat_bytes,feat_offsets[feature],feat_offsets[feature+1]) & np.uint64(size-1))
+        while table[slot] != -1:
+            slot = (slot+1) & (size-1)
+        table[slot] = feature
+    return table
+
+@njit(cache=True)
+def hash_table_lookup(table,feat_bytes,feat_offsets,key,start,end,code):
+    
+    """ Looks up key[start:end], with hash "code" (see "key_hash"), in the 
+    features hash table. Returns the feature index, or -1 if there is no such feature"""
+    
+    size = table.size
+    slot = np.int64(code & np.uint64(size-1))
+    while table[slot] != -1:
+        feature = table[slot]
+        if feat_offsets[feature+1]-feat_offsets[feature] == end-start:
+            same = True
+            for n in range(end-start):
+                if feat_bytes[feat_offsets[feature]+n] != key[start+n]:
+                    same = False
+                    break
+            if same:
+                return feature
+        slot = (slot+1) & (size-1)
+    return -1
+
+def binary_converter(features,mismatch):
+
+    """ Parses the input features into matrices of packed uint64 words 
+    (see "word_packer"), with one feature per row. Features of different lengths 
+    are kept in different matrices, in a dictionary with the feature length as key 
+    and the matrix, the respective feature rows (see "Features"), the bits per basepair, 
+    the blocks index (see "blocks_indexer") and the one mismatch index 
+    (see "neighbours_indexer") as value.
+    This gives some computing speed advantages with mismatches.
+    Built once for all the samples (see "main")."""
+    
+    lengths = {}
+    for sequence,row in features.index.items():
+        lengths.setdefault(len(sequence),[]).append((sequence,row))
+    
+    container = {}
+    for length,sequences in lengths.items():
+        joined = b"".join(sequence for sequence,_ in sequences)
+        bits = dna_bits(joined)
+        feat_words = features_packer(seq2bin(joined).reshape(len(sequences),length),bits)
+        blocks = blocks_indexer([sequence for sequence,_ in sequences],length,mismatch)
+        neighbours = None
+        if bits == 2:
+            neighbours = neighbours_indexer([sequence for sequence,_ in sequences],length)
+        container[length] = (feat_words,[row for _,row in sequences],bits,blocks,neighbours)
+    return container
+
+@njit(cache=True)
+def features_packer(matrix,bits):
+    
+    """ Packs a matrix of same length features (int8, one feature per row) 
+    into a matrix of uint64 words (see "word_packer"), all in one call"""
+    
+    lanes = 64//bits
+    feat_words = np.zeros((matrix.shape[0],-(-matrix.shape[1]//lanes)), dtype=np.uint64)
+    for row in range(matrix.shape[0]):
+        feat_words[row] = word_packer(matrix[row],bits)[0][::lanes]
+    return feat_words
+
+def blocks_indexer(sequences,length,mismatch):
+    
+    """ Cuts the features into mismatch+1 blocks, and indexes the matrix rows of 
+    the features by the sequence of each block. A read with up to "mismatch" 
+    mismatches to a feature has at least one block identical to the same block 
+    of that feature, so only the features sharing a block with the read need 
+    to be compared with it. Returns a list of (start, end, block dictionary), 
+    or None when the blocks are too short to narrow down the features 
+    (less possible block sequences than features)"""
+    
+    if 4**(length//(mismatch+1)) < len(sequences):
+        return None
     
-    if seq in passed_reads:
-        features[passed_reads[seq]].counts += 1
-        imperfect_counter += 1
-        return features,imperfect_counter,failed_reads,passed_reads,non_aligned_counter
+    blocks = []
+    for n in range(mismatch+1):
+        start,end = n*length//(mismatch+1), (n+1)*length//(mismatch+1)
+        block = {}
+        for row,sequence in enumerate(sequences):
+            block.setdefault(sequence[start:end],[]).append(row)
+        blocks.append((start,end,block))
+    return blocks
+
+def neighbours_indexer(sequences,length,cap=2**20):
+    
+    """ Indexes all the sequences one mismatch away from the A/C/G/T features 
+    (each basepair swapped for the other 3 bases, or for an N) by the matrix row 
+    of the feature. A read found there is one mismatch away from that feature only, 
+    so it is aligned with a single dictionary lookup. The sequences one mismatch away
+    from more than one feature are kept as -1 (ambiguous read). 
+    Returns None when there would be more than "cap" sequences to index"""
+    
+    if 4*length*len(sequences) > cap:
+        return None
     
-    read=seq2bin(seq)                         
-    for miss in mismatch:
+    neighbours = {}
+    for row,sequence in enumerate(sequences):
+        for n in range(length):
+            head,tail = sequence[:n],sequence[n+1:]
+            for base in b"ACGTN":
+                if base != sequence[n]:
+                    neighbour = head+bytes((base,))+tail
+                    neighbours[neighbour] = row if neighbours.get(neighbour,row) == row else -1
+    return neighbours
+
+def features_hash_table(sequences):
+    
+    """ Lays out all the feature sequences (bytes) back to back in one uint8 array,
+    and indexes them in a hash table, so that perfect matches can be looked up 
+    from numba. The index of a feature is its position in "sequences", 
+    which is also its row in the Features class"""
+    
+    sequences = list(sequences)
+    feat_bytes = np.frombuffer(b"".join(sequences), dtype=np.uint8)
+    feat_offsets = np.cumsum([0]+[len(sequence) for sequence in sequences], dtype=np.int64)
+    return feat_bytes,feat_offsets,hash_table_builder(feat_bytes,feat_offsets)
+
+def neighbours_hash_table(binary_features):
+    
+    """ Gathers the one mismatch indexes of all the feature lengths (see "neighbours_indexer") 
+    into one hash table (see "features_hash_table"), so that the one mismatch reads 
+    are aligned in numba together with the perfect matches. Returns the hash table, 
+    the features rows (see "Features") of the indexed sequences (-1 when ambiguous), 
+    and the read lengths that were indexed"""
+    
+    sequences,rows = [],[]
+    covered = np.zeros(max(binary_features,default=0)+1, dtype=np.bool_)
+    for length,(_,feature_rows,_,_,neighbours) in binary_features.items():
+        if neighbours is not None:
+            covered[length] = True
+            sequences.extend(neighbours)
+            rows.extend(-1 if row == -1 else feature_rows[row] for row in neighbours.values())
+    
+    feat_bytes,feat_offsets,table = features_hash_table(sequences)
+    return table,feat_bytes,feat_offsets,np.array(rows, dtype=np.int64),covered
+
+@njit(cache=True)
+def fixed_reads_counter(chunk,bounds,reads,starts,ends,quality_mask,quality_check,table,feat_bytes,feat_offsets,counts,keys,key_bounds,fingerprints,
+                        neighbours_table,neighbours_bytes,neighbours_offsets,neighbours_rows,covered,single):
+    
+    """ Numba version of the fixed position read parsing in "reads_counter", 
+    for a batch of reads in a chunk of the fastq file (see "fastq_chunker").
+    Every read is trimmed at each start/end position pair, uppercased, and quality 
+    checked with the Phred table (see "phred_table") unless "quality_check" is False. The parts passing quality are 
+    joined by : and looked up in the features hash table, adding the perfect 
+    matches to "counts". The key is hashed while it is being trimmed, so each 
+    read is swept only once, and the hash doubles as the read fingerprint. 
+    The keys of the "covered" lengths are then looked up in the one mismatch 
+    hash table (see "neighbours_hash_table"), and with only 1 mismatch allowed ("single") 
+    the A/C/G/T/N keys not found there are not aligned. The remaining reads are written back to back
+    into "keys" (read n being keys[key_bounds[n]:key_bounds[n+1]]) for the mismatch search,
+    together with their fingerprints (see "read_fingerprint").
+    Returns the number of perfect matches, of imperfect matches, of quality failed reads, 
+    of not aligned reads, and of unmatched reads"""
+    
+    perfect,imperfect,quality_failed,non_aligned,unmatched = 0,0,0,0,0
+    position = 0
+    for read in range(reads):
+        seq_start,seq_end = bounds[4*read+1]+1,bounds[4*read+2]
+        qual_start = bounds[4*read+3]+1
+        key_start = position
+        code = np.uint64(14695981039346656037) #FNV-1a, same as "key_hash"
+        passed,other = False,False
+        
+        for i in range(starts.size):
+            first,last = slice_indices(starts[i],ends[i],seq_end-seq_start)
+            good = True
+            if quality_check:
+                for n in range(first,last):
+                    if quality_mask[chunk[qual_start+n]]:
+                        good = False
+                        break
+                
+            if good:
+                if passed:
+                    keys[position] = 58 #:
+                    other = True
+                    code = (code ^ np.uint64(58)) * np.uint64(1099511628211)
+                    position += 1
+                for n in range(first,last):
+                    base = chunk[seq_start+n]
+                    base = base-32 if 97 <= base <= 122 else base
+                    other |= (base != 65) & (base != 67) & (base != 71) & (base != 84) & (base != 78)
+                    keys[position] = base
+                    code = (code ^ np.uint64(base)) * np.uint64(1099511628211)
+                    position += 1
+                passed = True
+        
+        if not passed:
+            quality_failed += 1
+            continue
+        
+        feature = hash_table_lookup(table,feat_bytes,feat_offsets,keys,key_start,position,code)
+        if feature != -1:
+            counts[feature] += 1
+            perfect += 1
+            position = key_start
+            continue
+        
+        if (position-key_start < covered.size) and covered[position-key_start]:
+            feature = hash_table_lookup(neighbours_table,neighbours_bytes,neighbours_offsets,keys,key_start,position,code)
+            if feature != -1:
+                if neighbours_rows[feature] != -1:
+                    counts[neighbours_rows[feature]] += 1
+                    imperfect += 1
+                else:
+                    non_aligned += 1
+                position = key_start
+                continue
+            if single and not other:
+                non_aligned += 1
+                position = key_start
+                continue
+        
+        fingerprints[unmatched] = code
+        unmatched += 1
+        key_bounds[unmatched] = position
+            
+    return perfect,imperfect,quality_failed,non_aligned,unmatched
 
-        feature = features_all_vs_all(binary_features, read, miss)
+def jit_warmup():
+    
+    """ Compiles the numba read counting kernel with a dummy read, so that 
+    it is ready (and cached) before the files start being processed. 
+    The lookup tables are read only, as when memory mapped (see "arrays_loader")"""
+    
+    tables = features_hash_table([b"A"]) + neighbours_hash_table({})
+    for array in tables:
+        array.flags.writeable = False
+    feat_bytes,feat_offsets,table = tables[:3]
+    fixed_reads_counter(np.frombuffer(b"@\nA\n+\nF\n", dtype=np.uint8),
+                        np.array([-1,1,3,5,7], dtype=np.int64),1,
+                        np.zeros(1, dtype=np.int64),np.ones(1, dtype=np.int64),
+                        np.frombuffer(phred_table(set()), dtype=np.uint8),True,
+                        table,feat_bytes,feat_offsets,
+                        np.zeros(1, dtype=np.int64),np.empty(1, dtype=np.uint8),np.zeros(2, dtype=np.int64),
+                        np.empty(1, dtype=np.uint64),*tables[3:],True)
+
+@njit(cache=True)
+def sorted_search(array,value):
+    
+    """ Binary search of a value in a sorted array. Returns its position, 
+    or -1 if the value is not there"""
+    
+    place = np.searchsorted(array,value)
+    if (place < array.size) and (array[place] == value):
+        return place
+    return -1
+
+def read_fingerprint(seq):
+    
+    """ 64 bit fingerprint of a read (bytes), used as the key of the failed and 
+    passed reads hash tables. Unlike hash(), it is the same in every process"""
+    
+    return int(key_hash(np.frombuffer(seq, dtype=np.uint8),0,len(seq)))
+
+def mismatch_search_handler(seq,fingerprint,mismatch,failed_reads,binary_features,imperfect_counter,counts,passed_reads,known_reads,param,non_aligned_counter):
+    
+    """Converts a read into packed uint64 form. Runs the imperfect alignment 
+    search for all number of inputed mismatches against the features 
+    with the same length as the read. The outcome is kept in the failed/passed 
+    reads hash tables under the read fingerprint, with the passed reads keeping the
+    row of the aligned feature in "counts". Both tables have a capped size, 
+    with the passed reads dropping the least recently seen read first.
+    The reads already known from the previous samples are searched for
+    in the shared sorted fingerprints (see "hash_tables_loader")."""
+    
+    if fingerprint in failed_reads:
+        non_aligned_counter += 1
+        return counts,imperfect_counter,failed_reads,passed_reads,non_aligned_counter
+    
+    if fingerprint in passed_reads:
+        passed_reads.move_to_end(fingerprint)
+        counts[passed_reads[fingerprint]] += 1
+        imperfect_counter += 1
+        return counts,imperfect_counter,failed_reads,passed_reads,non_aligned_counter
+    
+    known_failed,known_passed,known_rows = known_reads
+    if known_failed.size + known_passed.size != 0:
+        key = np.uint64(fingerprint)
+        if sorted_search(known_failed,key) != -1:
+            non_aligned_counter += 1
+            return counts,imperfect_counter,failed_reads,passed_reads,non_aligned_counter
+        place = sorted_search(known_passed,key)
+        if place != -1:
+            counts[known_rows[place]] += 1
+            imperfect_counter += 1
+            return counts,imperfect_counter,failed_reads,passed_reads,non_aligned_counter
+    
+    if len(seq) in binary_features:
+        feat_words,rows,bits,blocks,neighbours = binary_features[len(seq)]
+        index = None
+        if neighbours is not None:
+            # one mismatch away from one feature is the first hit of any mismatch search
+            index = neighbours.get(seq)
+            if (index is None) & (mismatch[-1] == 1) & (seq.translate(None,b"ACGTN") == b""):
+                index = -1
         
-        if feature is not None:
-            features[feature].counts += 1
+        if index is None:
+            candidates = None
+            if blocks is not None:
+                candidates = sorted({row for start,end,block in blocks for row in block.get(seq[start:end],())})
+            
+            index = -1
+            if candidates != []:
+                if candidates is not None:
+                    feat_words = feat_words[candidates]
+                    rows = [rows[row] for row in candidates]
+                index = features_all_vs_all(feat_words,seq2bin(seq),mismatch[-1],bits)
+        
+        if index != -1:
+            feature = rows[index]
+            counts[feature] += 1
             imperfect_counter += 1
-            passed_reads[seq] = feature
-            return features,imperfect_counter,failed_reads,passed_reads,non_aligned_counter
+            passed_reads[fingerprint] = feature
+            if len(passed_reads) > param['passed_reads_cap']:
+                passed_reads.popitem(last=False)
+            return counts,imperfect_counter,failed_reads,passed_reads,non_aligned_counter
     
-        else: 
-            if miss == mismatch[-1]:
-                #if function reaches here its because nothing was aligned anywhere
-                if ram_clearance:
-                    failed_reads.add(seq)
-                non_aligned_counter += 1
-                return features,imperfect_counter,failed_reads,passed_reads,non_aligned_counter
+    #if function reaches here its because nothing was aligned anywhere
+    if len(failed_reads) < param['failed_reads_cap']:
+        failed_reads.add(fingerprint)
+    non_aligned_counter += 1
+    return counts,imperfect_counter,failed_reads,passed_reads,non_aligned_counter
 
-def aligner(raw,i,o,features,param,cpu,failed_reads,passed_reads):
+def aligner(raw,i,o,features,param,cpu,hash_tables):
 
     """ Runs the main read to sgRNA associating function "reads_counter".
     Creates some visual prompts to alert the user that the samples are being
@@ -441,14 +1143,45 @@ def aligner(raw,i,o,features,param,cpu,failed_reads,passed_reads):
     number of reads per sample, and checking total running time"""
     
     tempo = time.perf_counter()
+    failed_reads,passed_reads,known_reads = hash_tables_loader(hash_tables)
 
     reads, perfect_counter, imperfect_counter, features,failed_reads,passed_reads,non_aligned_counter,quality_failed = \
-        reads_counter(i,o,raw,features,param,cpu,failed_reads,passed_reads)
+        reads_counter(i,o,raw,features,param,cpu,failed_reads,passed_reads,False,None,known_reads)
+    
+    sample = sample_writer(raw,features,param,time.perf_counter() - tempo,reads,perfect_counter,imperfect_counter,non_aligned_counter,quality_failed)
 
-    master_list = []
-    [master_list.append([features[guide].name] + [features[guide].counts]) for guide in features]
+    return failed_reads,passed_reads,sample
+
+def part_counter(i,o,raw,features,param,cpu,place,hash_tables):
+    
+    """ Runs "reads_counter" for one part of a file (see "parts_aligner").
+    Returns the failed and passed reads, and the file index together with 
+    the starting time and the results"""
+    
+    begin = time.time()
+    failed_reads,passed_reads,known_reads = hash_tables_loader(hash_tables)
+    
+    reads, perfect_counter, imperfect_counter, features,failed_reads,passed_reads,non_aligned_counter,quality_failed = \
+        reads_counter(i,o,raw,features,param,cpu,failed_reads,passed_reads,False,place,known_reads)
+    
+    return failed_reads,passed_reads,(i,begin,(reads,perfect_counter,imperfect_counter,features,non_aligned_counter,quality_failed))
+
+def sample_writer(raw,features,param,tempo,reads,perfect_counter,imperfect_counter,non_aligned_counter,quality_failed):
+    
+    """ Writes the counts and the quality control stats of a sample into 
+    its own .csv file. Returns the .csv file path, stats line, feature names 
+    and counts of the sample, which are compiled directly (see "compiling") 
+    instead of being parsed back from the .csv file"""
+
+    names = features.names
+    counts = features.counts
+    
+    # the features loaded in Counter mode are already in output order (see "features_loader")
+    if param['Running Mode'] != 'C': 
+        order = np.argsort(np.array(names), kind="stable")
+        names = [names[n] for n in order.tolist()]
+        counts = counts[order]
 
-    tempo = time.perf_counter() - tempo
     if tempo > 3600:
         timing = str(round(tempo / 3600, 2)) + " hours"   
     elif tempo > 60:
@@ -467,24 +1200,24 @@ def aligner(raw,i,o,features,param,cpu,failed_reads,passed_reads):
     if not param['Progress bar']:
         print(f"\n{Fore.BLUE} {datetime.datetime.now().strftime('%c')}{Fore.RESET} [{Fore.GREEN}INFO{Fore.RESET}] Sample {name} was processed in {timing}")
         
-    try:
-        master_list.sort(key = lambda master_list: int(master_list[0])) #numerical sorting
-    except ValueError:
-        master_list.sort(key = lambda master_list: master_list[0]) #alphabetical sorting
-    
-    master_list.insert(0,["#Feature"] + ["Reads"])
-    master_list.insert(0,[stats_condition])
+    master_list = [[stats_condition],["#Feature"] + ["Reads"]]
+    master_list.extend(zip(names,counts.tolist()))
     
     csvfile = os.path.join(param["directory"], name+"_reads.csv")
     csv_writer(csvfile, master_list)
-
-    return failed_reads,passed_reads
+    
+    # in Counter mode the parent process already has the features names
+    if param['Running Mode'] == 'C':
+        names = None
+    
+    return csvfile,stats_condition,names,counts
 
 def csv_writer(path, outfile):
     
-    """ writes the indicated outfile into an .csv file in the directory"""
+    """ writes the indicated outfile into an .csv file in the directory.
+    A 1MB buffer keeps the number of write calls low for large feature lists"""
         
-    with open(path, "w", newline='') as output: 
+    with open(path, "w", newline='', buffering=1048576) as output: 
         writer = csv.writer(output)
         writer.writerows(outfile)
 
@@ -798,6 +1531,15 @@ def initializer(cmd):
     param["quality_set"] = set(quality_list[:int(param['phred'])-1])
     param["quality_set_up"] = set(quality_list[:int(param['qual_up'])-1])
     param["quality_set_down"] = set(quality_list[:int(param['qual_down'])-1])
+    param["quality_table"] = phred_table(param["quality_set"])
+    param["quality_table_up"] = phred_table(param["quality_set_up"])
+    param["quality_table_down"] = phred_table(param["quality_set_down"])
+    # with the minimal Phred score nothing can fail, and the checks are skipped
+    param["quality_check"] = len(param["quality_set"]) > 0
+    param["quality_check_up"] = len(param["quality_set_up"]) > 0
+    param["quality_check_down"] = len(param["quality_set_down"]) > 0
+    
+    jit_warmup()
     
     current_time = datetime.datetime.now().strftime('%Y_%m_%d_%H_%M_%S')
     param["directory"] = os.path.join(param['out'], f"2FAST2Q_output_{current_time}")
@@ -865,20 +1607,20 @@ def input_parser():
     parser.add_argument("--s",help="The full path to the directory with the sequencing files OR file")
     parser.add_argument("--g",help="The full path to the .csv file with the sgRNAs.")
     parser.add_argument("--o",help="The full path to the output directory")
-    parser.add_argument("--fn",nargs='?',const="compiled",help="Specify an output compiled file name (default is called compiled)")
+    parser.add_argument("--fn",nargs='?',const="compiled",default="compiled",help="Specify an output compiled file name (default is called compiled)")
     parser.add_argument("--pb",nargs='?',const=False,help="Adds progress bars (default is enabled)")
-    parser.add_argument("--m",help="number of allowed mismatches (default=1)")
-    parser.add_argument("--ph",help="Minimal Phred-score (default=30)")
-    parser.add_argument("--st",help="Feauture start position in the read (default is 0==1st bp)")
-    parser.add_argument("--l",help="Feature length (default=20bp)")
+    parser.add_argument("--m",type=int,default=1,help="number of allowed mismatches (default=1)")
+    parser.add_argument("--ph",type=int,default=30,help="Minimal Phred-score (default=30)")
+    parser.add_argument("--st",default="0",help="Feauture start position in the read (default is 0==1st bp)")
+    parser.add_argument("--l",type=int,default=20,help="Feature length (default=20bp)")
     parser.add_argument("--us",help="Upstream search sequence")
     parser.add_argument("--ds",help="Downstream search sequence")
-    parser.add_argument("--msu",help="mismatches allowed in the upstream sequence")
-    parser.add_argument("--msd",help="mismatches allowed in the downstream sequence")
-    parser.add_argument("--qsu",help="Minimal Phred-score (default=30) in the upstream search sequence")
-    parser.add_argument("--qsd",help="Minimal Phred-score (default=30) in the downstream search sequence")
-    parser.add_argument("--mo",help="Running Mode (default=C) [Counter (C) / Extractor + Counter (EC)]")
-    parser.add_argument("--cp",help="Number of cpus to be used (default is max(cpu)-2 for >=3 cpus, -1 for >=2 cpus, 1 if 1 cpu")
+    parser.add_argument("--msu",type=int,default=0,help="mismatches allowed in the upstream sequence")
+    parser.add_argument("--msd",type=int,default=0,help="mismatches allowed in the downstream sequence")
+    parser.add_argument("--qsu",type=int,default=30,help="Minimal Phred-score (default=30) in the upstream search sequence")
+    parser.add_argument("--qsd",type=int,default=30,help="Minimal Phred-score (default=30) in the downstream search sequence")
+    parser.add_argument("--mo",default="C",help="Running Mode (default=C) [Counter (C) / Extractor + Counter (EC)]")
+    parser.add_argument("--cp",type=int,default=False,help="Number of cpus to be used (default is max(cpu)-2 for >=3 cpus, -1 for >=2 cpus, 1 if 1 cpu")
     parser.add_argument("--k",nargs='?',const=False,help="If enabled, keeps all temporary files (default is disabled)")
     args = parser.parse_args()
     
@@ -902,80 +1644,39 @@ def input_parser():
                        [pkg_resources.resource_filename(__name__, 'data/D39V_guides.csv'),'feature'],
                        [os.getcwd(),'out']]
        
-    parameters['out_file_name'] = "compiled"
-    if args.fn is not None:
-        parameters['out_file_name'] = args.fn
-
-    parameters['length']=20
-    if args.l is not None:
-        parameters['length']=int(args.l)
-        
-    parameters['Progress bar']=True
-    if args.pb is not None:
-        parameters['Progress bar']=False
-                 
-    parameters['start']="0"
-    if args.st is not None:
-        parameters['start']=args.st
-        
-    parameters['phred']=30
-    if args.ph is not None:
-        parameters['phred']=int(args.ph)
-        if int(parameters["phred"]) == 0:
-            parameters["phred"] = 1
-                 
-    parameters['miss']=1
-    if args.m is not None:
-        parameters['miss']=int(args.m)
-        
-    parameters['upstream']=None
-    if args.us is not None:
-        parameters['upstream']=args.us
-        
-    parameters['downstream']=None
-    if args.ds is not None:
-        parameters['downstream']=args.ds
-                 
-    parameters['miss_search_up']=0
-    if args.msu is not None:
-        parameters['miss_search_up']=int(args.msu)
-        
-    parameters['miss_search_down']=0
-    if args.msd is not None:
-        parameters['miss_search_down']=int(args.msd)
-        
-    parameters['qual_up']=30
-    if args.qsu is not None:
-        parameters['qual_up']=int(args.qsu)
-        
-    parameters['qual_down']=30
-    if args.qsd is not None:
-        parameters['qual_down']=int(args.qsd)
-        
-    parameters['Running Mode']="C"
-    if args.mo is not None:
-        if "EC" in args.mo.upper():
-            parameters['Running Mode']="EC"
-        
-    parameters['delete']=True
-    if args.k is not None:
-        parameters['delete']=False
-        
-    parameters['cpu']=False
-    if args.cp is not None:
-        parameters['cpu']=int(args.cp)
+    # the defaults and int conversions are done by the parser (see the arguments above)
+    parameters['out_file_name'] = args.fn
+    parameters['length'] = args.l
+    parameters['Progress bar'] = args.pb is None
+    parameters['start'] = args.st
+    parameters['phred'] = args.ph if args.ph != 0 else 1
+    parameters['miss'] = args.m
+    parameters['upstream'] = args.us
+    parameters['downstream'] = args.ds
+    parameters['miss_search_up'] = args.msu
+    parameters['miss_search_down'] = args.msd
+    parameters['qual_up'] = args.qsu
+    parameters['qual_down'] = args.qsd
+    parameters['Running Mode'] = "EC" if "EC" in args.mo.upper() else "C"
+    parameters['delete'] = args.k is None
+    parameters['cpu'] = args.cp
         
     for param in paths_param:
         parameters = current_dir_path_handling(param)
         
     return parameters
 
-def compiling(param):
+def compiling(param,samples,features):
 
     """ Combines all the individual processed .csv files into one final file.
+    The counts of every sample (see "sample_writer") are taken as they are, 
+    so the .csv files are only listed for their order, and never parsed back. 
+    In Counter mode the samples share the names of the loaded features. 
     Gathers the individual sample statistic and parses it into "run_stats" """
     
     ordered_csv = path_parser(param["directory"], ['*reads.csv'])
+    samples = {sample[0]:sample for sample in samples} # a file written twice keeps its last sample
+    samples = [samples[file] for file,_ in ordered_csv]
 
     headers = [f"#2FAST2Q version: {param['version']}"] + \
             [f"#Mismatch: {param['miss']}"] + \
@@ -994,40 +1695,32 @@ def compiling(param):
 
     compiled = {} #dictionary with all the reads per feature
     head = ["#Feature"] #name of the samples
-    for i, file in enumerate(ordered_csv):
+    for i, (file,stats_condition,names,counts) in enumerate(samples):
         path,_ = os.path.splitext(file)
         path = Path(path).stem
         path = path[:-len("_reads")]
         head.append(path)
-        with open(file) as current:
-            for line in current:
-                line = line[:-1].split(",")
-                if "#" not in line[0]:
-                    
-                    if line[0] in compiled: 
-                        compiled[line[0]] = compiled[line[0]] + [int(line[1])]
-                    else:
-                        compiled[line[0]] = [0]*i + [int(line[1])]
-                        
-                elif "#Feature" not in line[0]:
-                    headers.append(line[0][1:]+"\n")
-    
-        #important in extract and count mode for creating entries with 0 reads
-        for entry in compiled:
-            if len(compiled[entry])<i+1:
-                compiled[entry] = compiled[entry] + [0]*(i+1-len(compiled[entry]))
+        headers.append(stats_condition[1:]+"\n")
+        if names is None:
+            names = features.names
+        for name,count in zip(names,counts.tolist()):
+            
+            #every feature gets a full row of samples on its first appearance, 
+            #which also gives 0 reads to the samples missing it in extract and count mode
+            if name not in compiled: 
+                compiled[name] = [0]*len(samples)
+            compiled[name][i] += count
 
     run_stats(headers,param,compiled,head)
 
-    final = []
-    [final.append([feature] + compiled[feature]) for feature in compiled] 
-    final.insert(0, head)
+    # the rows are generated while being written, so the table isn't copied in memory
+    final = chain([head], ([feature] + counts for feature,counts in compiled.items()))
     
     csvfile = os.path.join(param["directory"],f"{param['out_file_name']}.csv")
     csv_writer(csvfile, final)
 
     if param["delete"]:
-        for file in ordered_csv:
+        for file,_ in ordered_csv:
             os.remove(file)
             
     print(f"\n {Fore.BLUE}{datetime.datetime.now().strftime('%c')}{Fore.RESET} [{Fore.GREEN}INFO{Fore.RESET}] Analysis successfully completed")
@@ -1066,71 +1759,65 @@ def run_stats(headers, param, compiled, head):
     csvfile = os.path.join(param["directory"],f"{param['out_file_name']}_stats.csv")
     csv_writer(csvfile, global_stat)
     
-    ######## for bar plots with absolute number of reads
+    # the read numbers of all samples, one column per stat
+    numbers = np.array([n[3:] for n in global_stat[header_ofset:]], dtype=np.int64).reshape(-1,6)
+    total_reads,aligned,not_aligned,q_failed = numbers[:,0],numbers[:,1],numbers[:,4],numbers[:,5]
+    samples = np.arange(len(numbers))
     
-    fig, ax = plt.subplots(figsize=(12, int(len(global_stat)/4)))
-    width = .75
-    for i, (_,_,_,total_reads,aligned,_,_,not_aligned,_) in enumerate(global_stat[header_ofset:]):   
+    def bar_plot(layers,xlabel,legend,name):
         
-        plt.barh(i, int(total_reads), width,  capsize=5, color = "#FFD25A", hatch="//",edgecolor = "black", linewidth = .7)
-        plt.barh(i, int(aligned), width,  capsize=5, color = "#FFAA5A", hatch="\\",edgecolor = "black", linewidth = .7)
-        plt.barh(i, int(not_aligned), width, capsize=5, color = "#F56416", hatch="x",edgecolor = "black", linewidth = .7)
-    
-    ax.set_yticks(np.arange(len([n[0] for n in global_stat[header_ofset:]])))
-    ax.set_yticklabels([n[0] for n in global_stat[header_ofset:]])
-    ax.tick_params(axis='both', which='major', labelsize=16)
-    ax.tick_params(axis='both', which='minor', labelsize=16)
-    plt.xlabel('Number of reads',size=20)
-    ax.spines['top'].set_visible(False)
-    ax.spines['right'].set_visible(False)
-    #ax.set_xscale('log')
-    ax.set_xlim(xmin=1)
-    ax.legend(["Total reads in sample", "Aligned reads","Reads that passed quality filtering but failed to align"], \
-              loc='right',bbox_to_anchor=(1.1, 1),ncol=3,prop={'size': 12})
-    plt.tight_layout()
-    file = os.path.join(param["directory"],f"{param['out_file_name']}_reads_plot.png")
-    plt.savefig(file, dpi=300, bbox_inches='tight')
+        """ Draws one horizontal bar plot of all the samples, with one barh call 
+        per layer of (widths, left, color, hatch). The bars are rasterized, 
+        so that the figure is flattened once when saved instead of per bar"""
+        
+        fig, ax = plt.subplots(figsize=(12, int(len(global_stat)/4)))
+        width = .75
+        for widths,left,color,hatch in layers:
+            ax.barh(samples, widths, width, capsize=5, left=left, color=color, hatch=hatch, edgecolor="black", linewidth=.7, rasterized=True)
+        
+        ax.set_yticks(samples)
+        ax.set_yticklabels([n[0] for n in global_stat[header_ofset:]])
+        ax.tick_params(axis='both', which='major', labelsize=16)
+        ax.tick_params(axis='both', which='minor', labelsize=16)
+        plt.xlabel(xlabel,size=20)
+        ax.spines['top'].set_visible(False)
+        ax.spines['right'].set_visible(False)
+        #ax.set_xscale('log')
+        ax.set_xlim(xmin=1)
+        ax.legend(legend,loc='right',bbox_to_anchor=(1.1, 1),ncol=3,prop={'size': 12})
+        plt.tight_layout()
+        file = os.path.join(param["directory"],f"{param['out_file_name']}_{name}.png")
+        plt.savefig(file, dpi=300, bbox_inches='tight')
+        plt.close(fig)
+    
+    ######## for bar plots with absolute number of reads
+    
+    bar_plot([(total_reads,None,"#FFD25A","//"),
+              (aligned,None,"#FFAA5A","\\"),
+              (not_aligned,None,"#F56416","x")],
+             'Number of reads',
+             ["Total reads in sample", "Aligned reads","Reads that passed quality filtering but failed to align"],
+             "reads_plot")
     
     ######## for bar plots with relative (percentage) number of reads
     
-    fig, ax = plt.subplots(figsize=(12, int(len(global_stat)/4)))
-    width = .75
-
-    for i, (_,_,_,total_reads,aligned,_,_,not_aligned,q_failed) in enumerate(global_stat[header_ofset:]):   
-
-        aligned = int(aligned)/int(total_reads)*100
-        not_aligned = int(not_aligned)/int(total_reads)*100
-        q_failed = int(q_failed)/int(total_reads)*100
-        
-        plt.barh(i, aligned, width,  capsize=5, color = "#6290C3", hatch="\\",edgecolor = "black", linewidth = .7)
-        plt.barh(i, not_aligned, width, capsize=5, left=aligned, color = "#F1FFE7", hatch="//",edgecolor = "black", linewidth = .7)
-        plt.barh(i, q_failed, width, capsize=5, left=not_aligned+aligned, color = "#FB5012", hatch="||",edgecolor = "black", linewidth = .7)
-    
-    ax.set_yticks(np.arange(len([n[0] for n in global_stat[header_ofset:]])))
-    ax.set_yticklabels([n[0] for n in global_stat[header_ofset:]])
-    ax.tick_params(axis='both', which='major', labelsize=16)
-    ax.tick_params(axis='both', which='minor', labelsize=16)
-    plt.xlabel('% of reads per sample',size=20)
-    ax.spines['top'].set_visible(False)
-    ax.spines['right'].set_visible(False)
-    #ax.set_xscale('log')
-    ax.set_xlim(xmin=1)
-    ax.legend(["Aligned reads","Reads that passed quality filtering but failed to align","Reads that did not pass quality filtering"], \
-              loc='right',bbox_to_anchor=(1.1, 1),ncol=3,prop={'size': 12})
-    plt.tight_layout()
-    file = os.path.join(param["directory"],f"{param['out_file_name']}_reads_plot_percentage.png")
-    plt.savefig(file, dpi=300, bbox_inches='tight')
+    with np.errstate(divide="ignore", invalid="ignore"): # a sample without reads has no percentages
+        aligned = aligned/total_reads*100
+        not_aligned = not_aligned/total_reads*100
+        q_failed = q_failed/total_reads*100
+    
+    bar_plot([(aligned,None,"#6290C3","\\"),
+              (not_aligned,aligned,"#F1FFE7","//"),
+              (q_failed,not_aligned+aligned,"#FB5012","||")],
+             '% of reads per sample',
+             ["Aligned reads","Reads that passed quality filtering but failed to align","Reads that did not pass quality filtering"],
+             "reads_plot_percentage")
     
     ########
     """ For plotting a violin plot distribution """
     
-    distributions = {}
-    for feature in compiled:
-        for i,read in enumerate(compiled[feature]):
-            if head[i+1] in distributions:
-                distributions[head[i+1]].append(read)
-            else:
-                distributions[head[i+1]] = [read]
+    # the compiled rows are already a features x samples matrix, with one row per sample once transposed
+    distributions = np.array(list(compiled.values()), dtype=np.int64).reshape(len(compiled),len(head)-1).T
     
     def adjacent_values(vals, q1, q3):
         upper_adjacent_value = q3 + (q3 - q1) * 1.5
@@ -1179,32 +1866,19 @@ def run_stats(headers, param, compiled, head):
         else:
             file = os.path.join(param["directory"],f"{param['out_file_name']}_distribution_normalized_RPM_plot.png")
         plt.savefig(file, dpi=300, bbox_inches='tight')
+        plt.close(fig)
     
-    data = []
-    for entry in distributions:
-        data.append(distributions[entry])
-    violin(data,head)
+    violin(list(distributions),head)
     
     ## normalized RPM
+    sums = distributions.sum(axis=1, keepdims=True)
+    reads = sums[:,0] > 0
+    data = distributions[reads]/sums[reads]*1000000 #RPM
     try:
-        data = np.array(data)
-        data1 = []
-        for i,entry in enumerate(data):
-            if sum(entry)>0:
-                data1.append(entry/sum(entry)*1000000) #RPM
-        violin(data1,head,normalized=True)
-    except ValueError:
+        violin(list(data),head,normalized=True)
+    except ValueError: # no sample has any reads
         pass
 
-def ram_lock():
-
-    """ stops increasing the hash tables (failed and passed reads) 
-    size to avoid using RAM that isnt there """
-
-    if psutil.virtual_memory().percent >= 95:
-        return False
-    return True
-
 def cpu_counter(cpu):
     
     """ counts the available cpu cores, required for spliting the processing
@@ -1227,41 +1901,226 @@ def cpu_counter(cpu):
     
     return pool,cpu
 
-def multiprocess_merger(start,failed_reads,passed_reads,files,features,param,pool,cpu,preprocess=False):
+def jobs_dispatcher(function,jobs,files,param,pool,cpu,failed_reads,passed_reads):
     
-    """ runs all samples in blocks equal to the amount of cpus in the PC. 
-    Before starting a new block, the hash tables for the failed and passed reads 
-    are updated. This confers speed advantages for the next block. """ 
+    """ Runs "function" on every job (its arguments, the shared hash tables 
+    being added last). The next job is handed to whichever process is free, 
+    so that a slow job never holds back the others. "function" returns the 
+    failed and passed reads it found, and its result. The failed and passed 
+    reads hash tables are updated as the jobs are finished, and shared anew 
+    (see "hash_tables_sharer") with the jobs starting after every "cpu" 
+    finished jobs. This confers speed advantages for the next jobs.
+    Yields the results as the jobs finish"""
     
-    result = []
-    for i, name in enumerate(files[start:start+cpu]):
+    finished = queue.Queue()
+    shared,hash_tables = hash_tables_sharer(failed_reads,passed_reads,param)
+    users = {shared:0} # the running jobs using each shared hash tables file
+    
+    failed_reads_compiled,passed_reads_compiled = [],[]
+    following,running = 0,0
+    try:
+        while (following < len(jobs)) or (running > 0):
+            if (following < len(jobs)) & (running < cpu):
+                users[shared] += 1
+                pool.apply_async(function, args=(*jobs[following],hash_tables),
+                                 callback=lambda result,path=shared: finished.put((result,path)),
+                                 error_callback=lambda error,path=shared: finished.put((error,path)))
+                following += 1
+                running += 1
+                continue
+            
+            result,path = finished.get()
+            running -= 1
+            if isinstance(result,BaseException):
+                raise result
+            
+            users[path] -= 1
+            if (path is not None) & (path != shared) & (users[path] == 0):
+                os.remove(path)
+                del users[path]
+            yield result[2]
+            
+            if param["miss"] != 0:
+                failed_reads_compiled.append(result[0])
+                passed_reads_compiled.append(result[1])
+                if len(failed_reads_compiled) == cpu:
+                    failed_reads,passed_reads = hash_reads_parsing(files,failed_reads_compiled,passed_reads_compiled,failed_reads,passed_reads,param)
+                    failed_reads_compiled,passed_reads_compiled = [],[]
+                    if users[shared] == 0:
+                        os.remove(shared)
+                        del users[shared]
+                    shared,hash_tables = hash_tables_sharer(failed_reads,passed_reads,param)
+                    users[shared] = 0
+    
+    finally: # also when a job fails or the run is interrupted
+        for path in users:
+            if path is not None:
+                try:
+                    os.remove(path)
+                except OSError: # still open in a running process on windows
+                    pass
+
+def files_aligner(files,features,param,pool,cpu,failed_reads,passed_reads):
+    
+    """ Runs all the samples, one per process (see "jobs_dispatcher").
+    Returns the samples (see "sample_writer")"""
+    
+    jobs = [(raw,i,len(files),features,param,cpu) for i,raw in enumerate(files)]
+    
+    return list(jobs_dispatcher(aligner,jobs,files,param,pool,cpu,failed_reads,passed_reads))
+
+def parts_aligner(files,features,param,pool,cpu,failed_reads,passed_reads):
+    
+    """ Used when there are less files than cpus, or when an uncompressed file
+    is bigger than the share of one cpu. The uncompressed files are 
+    split into parts (see "fastq_splitter"), so that all the cpus are kept busy 
+    even with a single sample. With as many files as cpus, every file is split 
+    into as many shares of one cpu as it holds, so that the biggest files 
+    don't run alone at the end. The parts are run as in "files_aligner", 
+    and once all parts of a file are done their counts are summed and written
+    (see "sample_writer"), timed from the start of its first part. Returns the samples """
+    
+    total = sum(param["file_sizes"][raw] for raw in files)
+    jobs = []
+    for i,raw in enumerate(files):
+        parts = -(-cpu//len(files))
+        if len(files) >= cpu:
+            parts = -(-param["file_sizes"][raw]*cpu//total)
+        for place in fastq_splitter(raw,param["file_sizes"][raw],parts):
+            jobs.append((i,len(files),raw,features,param,cpu,place))
+    
+    pending = [0]*len(files)
+    for job in jobs:
+        pending[job[0]] += 1
+    
+    merged = [None]*len(files)
+    started = [None]*len(files)
+    samples = []
+    for i,begin,result in jobs_dispatcher(part_counter,jobs,files,param,pool,cpu,failed_reads,passed_reads):
+        reads,perfect_counter,imperfect_counter,part_features,non_aligned_counter,quality_failed = result
+        
+        started[i] = begin if started[i] is None else min(started[i],begin)
+        
+        if merged[i] is None:
+            merged[i] = [part_features,reads,perfect_counter,imperfect_counter,non_aligned_counter,quality_failed]
+        else:
+            sample_features = merged[i][0]
+            if param['Running Mode']=='C': # all parts share the same features rows
+                sample_features.counts += part_features.counts
+            else:
+                rows = []
+                for sequence,row in part_features.index.items():
+                    if sequence not in sample_features.index:
+                        sample_features.index[sequence] = len(sample_features.names)
+                        sample_features.names.append(part_features.names[row])
+                    rows.append(sample_features.index[sequence])
+                counts = np.zeros(len(sample_features.names), dtype=np.int64)
+                counts[:sample_features.counts.size] = sample_features.counts
+                counts[rows] += part_features.counts
+                sample_features.counts = counts
+            for n,count in enumerate((reads,perfect_counter,imperfect_counter,non_aligned_counter,quality_failed)):
+                merged[i][n+1] += count
         
-        result.append(pool.apply_async(aligner, args=(name,\
-                                                      i+start,\
-                                                      len(files),\
-                                                      features,\
-                                                      param,\
-                                                      cpu,\
-                                                      failed_reads,\
-                                                      passed_reads)))
+        pending[i] -= 1
+        if pending[i] == 0:
+            samples.append(sample_writer(files[i],merged[i][0],param,time.time() - started[i],*merged[i][1:]))
+            merged[i] = None
     
-    if param["miss"] != 0:
-        compiled = [x.get() for x in result]
-        failed_reads_compiled,passed_reads_compiled = zip(*compiled)
-        return hash_reads_parsing(result,failed_reads_compiled,passed_reads_compiled,failed_reads,passed_reads)
+    return samples
+
+def hash_tables_sharer(failed_reads,passed_reads,param):
     
-    else:
-        return failed_reads,passed_reads
+    """ Lays out the failed and passed reads hash tables (sorted failed fingerprints, 
+    then sorted passed fingerprints, then the passed features rows) as one uint64 
+    array in a temporary .npy file in the output directory. All the processes memory map the tables 
+    from there, instead of each being sent its own pickled copy. Returns the 
+    file path and the tables description (path and sizes) to hand over to the 
+    processes. Without mismatches the tables are never used, and nothing is shared"""
+    
+    if param["miss"] == 0:
+        return None,None
+    
+    failed = len(failed_reads)
+    passed = len(passed_reads)
+    table = np.empty(failed+2*passed, dtype=np.uint64)
+    table[:failed] = np.sort(np.fromiter(failed_reads, dtype=np.uint64, count=failed))
+    fingerprints = np.fromiter(passed_reads.keys(), dtype=np.uint64, count=passed)
+    order = np.argsort(fingerprints)
+    table[failed:failed+passed] = fingerprints[order]
+    table[failed+passed:] = np.fromiter(passed_reads.values(), dtype=np.uint64, count=passed)[order]
+    
+    handle,path = tempfile.mkstemp(suffix=".npy", prefix="hash_tables_", dir=param["directory"])
+    with os.fdopen(handle, "wb") as current:
+        np.save(current, table)
+    
+    return path,(path,failed,passed)
 
-def hash_reads_parsing(result,failed_reads_compiled,passed_reads_compiled,failed_reads,passed_reads):
+def arrays_sharer(arrays,name,param):
+    
+    """ Saves the lookup tables arrays built once for all the samples (see "main")
+    as .npy files in the output directory, so that every process memory maps 
+    them (see "arrays_loader") instead of being sent a pickled copy with every job.
+    Returns the files paths"""
+    
+    if not os.path.exists(param["directory"]):
+        os.makedirs(param["directory"])
+    
+    paths = []
+    for n,array in enumerate(arrays):
+        paths.append(os.path.join(param["directory"], f"{name}_{n}.npy"))
+        np.save(paths[-1], array)
+    return paths
+
+def arrays_loader(paths):
+    
+    """ Memory maps the lookup tables arrays saved by "arrays_sharer", read only"""
+    
+    return tuple(np.asarray(np.load(path, mmap_mode="r")) for path in paths)
+
+def hash_tables_loader(hash_tables):
+    
+    """ Memory maps the shared failed and passed reads hash tables 
+    (see "hash_tables_sharer") as read only sorted arrays, which are binary 
+    searched instead of being rebuilt into python sets in every process. 
+    Returns new empty hash tables, that only keep the reads found by this 
+    process, and are thus the only ones sent back to the parent process"""
+    
+    if hash_tables is None:
+        empty = np.zeros(0, dtype=np.uint64)
+        empty.flags.writeable = False
+        return set(),OrderedDict(),(empty,empty,empty.view(np.int64))
+    
+    path,failed,passed = hash_tables
+    table = np.asarray(np.load(path, mmap_mode="r"))
+    known_reads = (table[:failed],table[failed:failed+passed],table[failed+passed:].view(np.int64))
+    
+    return set(),OrderedDict(),known_reads
+
+def hash_tables_caps(param,cpu):
+    
+    """ Sets the maximal number of reads kept in the failed/passed reads hash tables.
+    Every process, and the parent process, can fill its own tables up to the caps, 
+    so the available RAM is shared between them (about 80 bytes per failed read 
+    and 190 bytes per passed read), up to 20M failed and 2M passed reads"""
+    
+    share = psutil.virtual_memory().available // (cpu+1) // 2
+    param["failed_reads_cap"] = min(20000000, share//80)
+    param["passed_reads_cap"] = min(2000000, share//190)
+
+def hash_reads_parsing(result,failed_reads_compiled,passed_reads_compiled,failed_reads,passed_reads,param):
     
     """ parsed the results from all the processes, merging the individual failed and
     passed reads into one master file, that will be subsquently used for the new
-    samples's processing """ 
+    samples's processing. The master files are kept within the hash tables size caps """ 
     
     for failed,passed in zip(failed_reads_compiled,passed_reads_compiled):
-        failed_reads = set.union(failed_reads,failed)
-        passed_reads = {**passed_reads,**passed}
+        failed_reads.update(failed)
+        passed_reads.update(passed)
+    
+    while len(failed_reads) > param['failed_reads_cap']:
+        failed_reads.pop()
+    while len(passed_reads) > param['passed_reads_cap']:
+        passed_reads.popitem(last=False)
 
     return failed_reads,passed_reads
 
@@ -1276,37 +2135,44 @@ def hash_preprocesser(files,features,param,pool,cpu):
     result=[]
 
     for name in files[:cpu]:
-        result.append(pool.apply_async(reads_counter, args=(0,0,name,features,param,cpu,set(),{},True)))
+        result.append(pool.apply_async(reads_counter, args=(0,0,name,features,param,cpu,set(),OrderedDict(),True)))
     
     compiled = [x.get() for x in result]
 
     _,_,_,_,failed_reads_compiled,passed_reads_compiled,_,_ = zip(*compiled)
 
-    return hash_reads_parsing(result,failed_reads_compiled,passed_reads_compiled,set(),{})
+    return hash_reads_parsing(result,failed_reads_compiled,passed_reads_compiled,set(),OrderedDict(),param)
 
 def aligner_mp_dispenser(files,features,param):
     
     """ starts and handles the parallel processing of all the samples by calling 
-    multiple instances of the "aligner" function (one per sample) """
+    multiple instances of the "aligner" function (one per sample). 
+    Returns the processed samples (see "sample_writer") """
     
     if not os.path.exists(param["directory"]):
         os.makedirs(param["directory"])
     
-    start,failed_reads,passed_reads = 0,set(),{}
+    failed_reads,passed_reads = set(),OrderedDict()
     pool,cpu = cpu_counter(param["cpu"])
+    hash_tables_caps(param,cpu)
     
     if param["miss"] != 0:
         failed_reads,passed_reads=hash_preprocesser(files,features,param,pool,cpu)
     
     print(f"{Fore.BLUE} {datetime.datetime.now().strftime('%c')}{Fore.RESET} [{Fore.GREEN}INFO{Fore.RESET}] Processing {len(files)} files. Please hold.")
 
-    for start in range(0,len(files),cpu):
-        failed_reads,passed_reads = \
-        multiprocess_merger(start,failed_reads,passed_reads,files,\
-                            features,param,pool,cpu)
+    # an uncompressed file bigger than the share of one cpu would otherwise keep running alone at the end
+    biggest = max([param["file_sizes"][raw] for raw in files if os.path.splitext(raw)[1] != ".gz"], default=0)
+    if (len(files) < cpu) or (biggest*cpu > sum(param["file_sizes"][raw] for raw in files)):
+        samples = parts_aligner(files,features,param,pool,cpu,failed_reads,passed_reads)
+    
+    else:
+        samples = files_aligner(files,features,param,pool,cpu,failed_reads,passed_reads)
         
     pool.close()
     pool.join()
+    
+    return samples
 
 def main():
     
@@ -1316,22 +2182,40 @@ def main():
     param = initializer(input_parser())
     
     ### parses the names/paths, and orders the sequencing files
-    files = [param["seq_files"]]
+    files = [(param["seq_files"],os.path.getsize(param["seq_files"]))]
     if os.path.splitext(param["seq_files"])[1] == '':
         files = path_parser(param["seq_files"], ["*.gz","*.fastq"])
+    param["file_sizes"] = dict(files) # the files are only looked up on disk once
+    files = [path for path,_ in files]
 
     ### loads the features from the input .csv file. 
     ### Creates a dictionary "feature" of class instances for each sgRNA
-    features = {}
+    features = Features({},[],np.zeros(0, dtype=np.int64))
+    shared = []
     if param['Running Mode']=='C':
         features = features_loader(param["feature"])
+        
+        ### the lookup tables of the features are built once, and memory mapped by every process
+        if param["miss"] != 0:
+            param["binary_features"] = binary_converter(features,param["miss"])
+        if (param['upstream'] is None) & (param['downstream'] is None):
+            param["features_table"] = arrays_sharer(features_hash_table(features.index),"features_table",param)
+            param["neighbours_table"] = arrays_sharer(neighbours_hash_table(param.get("binary_features",{})),"neighbours_table",param)
+            shared = param["features_table"] + param["neighbours_table"]
+            # the reads are already looked up in the one mismatch hash table, so the dictionaries are left out
+            if param["miss"] != 0:
+                param["binary_features"] = {length:values[:4]+(None,) for length,values in param["binary_features"].items()}
     
     ### Processes all the samples by associating sgRNAs to the reads on the fastq files.
     ### Creates one process per sample, allowing multiple samples to be processed in parallel. 
-    aligner_mp_dispenser(files,features,param)
+    try:
+        samples = aligner_mp_dispenser(files,features,param)
+    finally:
+        for path in shared:
+            os.remove(path)
     
     ### Compiles all the processed samples from multi into one file, and creates the run statistics
-    compiling(param)
+    compiling(param,samples,features)
     
 if __name__ == "__main__":
     mp.freeze_support() # required to run multiprocess as .exe on windows
@@ -28,6 +28,7 @@ setup(
                            "dataclasses",\
                            "tk-tools >= 0.1",
                            "colorama"],
+        extras_require={"fast": ["rapidgzip","isal"]},
         entry_points={
         'console_scripts': [
             '2fast2q=fast2q.fast2q:main',  # Replace `2fast2q` with the command name you want to use